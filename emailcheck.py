@@ -1,37 +1,51 @@
 #!/usr/bin/env python3
 import os
 import sys
-import smtplib
 import ssl
 import json
+import base64
 import re
 import time
+import http.client
+import urllib.parse
 import urllib.request
-import urllib.error
 import configparser
+from collections import namedtuple
 from datetime import datetime, timezone
-from email.message import EmailMessage
+from hcw_common import CONFIG_FILE, LOG_FILE, get_db_name
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# smtplib and concurrent.futures are imported inside the functions that need
+# them, so the common "outbox is empty" cron run never loads them.
 
 # --- SETUP PATHS ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(BASE_DIR, "config.ini")
-WRANGLER_FILE = os.path.join(BASE_DIR, "wrangler.jsonc")
-ARCHIVE_FILE = os.path.join(BASE_DIR, "logs", "email_log")
-
-def get_db_name():
-    """Extracts database_name from wrangler.jsonc (supports comments)."""
-    default = "healthcheckwatch-db"
-    if not os.path.exists(WRANGLER_FILE):
-        return default
-    try:
-        with open(WRANGLER_FILE, 'r') as f:
-            content = f.read()
-            content = re.sub(r'//.*', '', content)
-            content = re.sub(r'/\*.*?\*/', '', content, flags=re.DOTALL)
-            data = json.loads(content)
-            return data.get("d1_databases", [{}])[0].get("database_name", default)
-    except Exception:
-        return default
+ARCHIVE_FILE = LOG_FILE
+ARCHIVE_LOCK_FILE = f"{LOG_FILE}.lock"
+ETAG_FILE = os.path.join(os.path.dirname(LOG_FILE), ".outbox_etag")
+
+# email_log is rotated to email_log.1 .. email_log.3 once it passes 5 MiB
+ROTATE_BYTES = 5 * 1024 * 1024
+ROTATE_KEEP = 3
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Matches the UTC timestamps Cloudflare writes into alert bodies
+TIMESTAMP_RE = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+_local_time_cache = {}
+
+# One verified TLS context (and one CA bundle load) serves both the API and SMTP
+_ssl_context = None
+
+def get_ssl_context():
+    """Returns the process-wide default SSL context, creating it on first use."""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
 
 def load_config():
     """Reads the config.ini file and returns the parser object."""
@@ -57,53 +71,144 @@ def check_security():
         
     return False
 
-def format_alert_times(config, alert):
-    """Aligns all times in the alert to either UTC or Local based on config."""
-    tz_setting = config.get('Settings', 'timezone', fallback='local').lower()
+def convert_to_local(match):
+    """Converts a matched UTC timestamp string to local time, memoizing repeats."""
+    stamp = match.group(0)
+    local = _local_time_cache.get(stamp)
+    if local is None:
+        # Slicing the fixed-width fields is much cheaper than strptime
+        utc_dt = datetime(int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]),
+                          int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19]), tzinfo=timezone.utc)
+        # astimezone() without an argument picks the DST offset in effect at that instant
+        local = utc_dt.astimezone().strftime(TIME_FORMAT)
+        _local_time_cache[stamp] = local
+    return local
+
+def format_alert_times(tz_setting, alert):
+    """Aligns all times in the alert to either UTC or Local based on the timezone setting."""
     body_text = alert.get('body', '')
     
     if tz_setting == 'utc':
         # Force the email generation time to UTC
-        header_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        header_time = datetime.now(timezone.utc).strftime(TIME_FORMAT)
         final_body = body_text
     else:
         # Use local system time for the header
-        header_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        header_time = datetime.now().strftime(TIME_FORMAT)
         
-        # Helper to convert a matched UTC string to Local time
-        def convert_to_local(match):
-            # Parse the string as UTC
-            utc_dt = datetime.strptime(match.group(0), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
-            # Convert to local system timezone
-            return utc_dt.astimezone().strftime('%Y-%m-%d %H:%M:%S')
-            
         # Find all timestamps in the Cloudflare body and convert them
-        final_body = re.sub(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', convert_to_local, body_text)
+        final_body = TIMESTAMP_RE.sub(convert_to_local, body_text)
         
         # Change the column headers so the user knows it was converted
         final_body = final_body.replace('(UTC)', '(LOCAL)')
         
     return header_time, final_body
 
-def archive_locally(alert, db_name):
-    """Appends the alert to the local log file."""
+DIVIDER = "-" * 64
+
+def build_archive_record(alert, db_name):
+    """Formats one alert as a local log record with a single join."""
+    return "".join([
+        DIVIDER, "\nTIME:    ", str(alert.get('header_time')),
+        "\nDB:      ", db_name,
+        "\nSUBJECT: ", str(alert.get('subject')),
+        "\nMESSAGE:\n", (alert.get('body') or '').strip(),
+        "\n", DIVIDER, "\n\n",
+    ])
+
+def rotate_log(path):
+    """Shifts path to path.1 (and older copies up to ROTATE_KEEP) once it grows past ROTATE_BYTES."""
+    try:
+        if os.path.getsize(path) < ROTATE_BYTES:
+            return
+    except FileNotFoundError:
+        return
+    for i in range(ROTATE_KEEP, 0, -1):
+        src = f"{path}.{i - 1}" if i > 1 else path
+        if os.path.exists(src):
+            os.replace(src, f"{path}.{i}")
+
+def archive_locally(records):
+    """Rotates if needed, then appends a batch of log records in a single write, all under one lock."""
     os.makedirs(os.path.dirname(ARCHIVE_FILE), exist_ok=True)
     try:
-        with open(ARCHIVE_FILE, 'a') as f:
-            f.write("-" * 64 + "\n")
-            f.write(f"TIME:    {alert.get('header_time')}\n")
-            f.write(f"DB:      {db_name}\n")
-            f.write(f"SUBJECT: {alert.get('subject')}\n")
-            f.write("MESSAGE:\n")
-            f.write(alert.get('body', '').strip() + "\n")
-            f.write("-" * 64 + "\n\n")
+        data = memoryview("".join(records).encode('utf-8'))
+        # The lock lives in its own file so it survives email_log being renamed. Holding it
+        # across the size check and rotation stops overlapping runs from both rotating
+        # (and losing a generation), and keeps batches larger than PIPE_BUF from interleaving.
+        lock_fd = os.open(ARCHIVE_LOCK_FILE, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            rotate_log(ARCHIVE_FILE)
+            # O_BINARY (Windows only) keeps records LF-terminated like the rest of the log
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+            fd = os.open(ARCHIVE_FILE, flags, 0o644)
+            try:
+                while data:
+                    data = data[os.write(fd, data):]
+            finally:
+                os.close(fd)
+        finally:
+            os.close(lock_fd)
         return True
     except Exception as e:
         sys.stderr.write(f"Failed to write to archive: {e}\n")
         return False
 
-def send_email(config, alert, is_insecure):
-    """Sends the alert via SMTP using credentials from config.ini."""
+# SMTP credentials from config.ini, read once per run. A namedtuple rather than a
+# dataclass: dataclasses pulls in inspect, which is costly on the empty-outbox path.
+SmtpSettings = namedtuple('SmtpSettings', 'host port user password use_ssl context')
+
+def load_smtp_settings(config):
+    """Reads the [SMTP] section once and pairs it with the shared TLS context."""
+    return SmtpSettings(
+        host=config.get('SMTP', 'host'),
+        port=config.getint('SMTP', 'port'),
+        user=config.get('SMTP', 'user'),
+        password=config.get('SMTP', 'pass'),
+        use_ssl=config.getboolean('SMTP', 'use_ssl'),
+        context=get_ssl_context(),
+    )
+
+def open_smtp(settings):
+    """Opens an authenticated SMTP connection."""
+    import smtplib
+    if settings.use_ssl:
+        smtp = smtplib.SMTP_SSL(settings.host, settings.port, context=settings.context)
+    else:
+        smtp = smtplib.SMTP(settings.host, settings.port)
+    try:
+        if not settings.use_ssl:
+            smtp.starttls(context=settings.context)
+        smtp.login(settings.user, settings.password)
+    except Exception:
+        smtp.close()
+        raise
+    return smtp
+
+def close_smtp(smtp):
+    """Politely ends an SMTP session, dropping the socket if the server already hung up."""
+    try:
+        smtp.quit()
+    except Exception:
+        smtp.close()
+
+def check_smtp(settings, smtp):
+    """Returns a live SMTP connection, reopening it if the server dropped the old one."""
+    import smtplib
+    if smtp is not None:
+        try:
+            if smtp.noop()[0] == 250:
+                return smtp
+        except (smtplib.SMTPException, OSError):
+            pass
+        close_smtp(smtp)
+    return open_smtp(settings)
+
+def send_email(smtp, settings, alert, is_insecure):
+    """Sends the alert over an already authenticated SMTP connection. Raises on failure."""
+    from email.message import EmailMessage
     msg = EmailMessage()
     
     warning_block = ""
@@ -124,30 +229,142 @@ def send_email(config, alert, is_insecure):
     msg.set_content(content)
     
     msg['Subject'] = alert.get('subject', 'HealthcheckWatch Alert')
-    msg['From'] = config.get('SMTP', 'user')
-    msg['To'] = config.get('SMTP', 'user')
+    msg['From'] = settings.user
+    msg['To'] = settings.user
 
-    host = config.get('SMTP', 'host')
-    port = config.getint('SMTP', 'port')
-    user = config.get('SMTP', 'user')
-    password = config.get('SMTP', 'pass')
-    use_ssl = config.getboolean('SMTP', 'use_ssl')
+    if smtp.has_extn('pipelining'):
+        send_pipelined(smtp, msg, settings.user, settings.user)
+    else:
+        smtp.send_message(msg)
 
-    context = ssl.create_default_context()
+def send_pipelined(smtp, msg, sender, recipient):
+    """Sends msg with MAIL, RCPT and DATA batched into a single round trip (RFC 2920)."""
+    import smtplib
+    data = msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+    # Dot-stuff lines that start with '.' so they are not read as the end of DATA
+    data = re.sub(rb'(?m)^\.', b'..', data)
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+
+    mail_args = f"FROM:<{sender}>"
+    if smtp.has_extn('size'):
+        mail_args += f" SIZE={len(data)}"
+    smtp.putcmd('mail', mail_args)
+    smtp.putcmd('rcpt', f"TO:<{recipient}>")
+    smtp.putcmd('data')
+    mail_code, mail_resp = smtp.getreply()
+    rcpt_code, rcpt_resp = smtp.getreply()
+    data_code, data_resp = smtp.getreply()
+
+    if data_code == 354 and (mail_code != 250 or rcpt_code not in (250, 251)):
+        # The server should have refused DATA here; end it empty rather than leave it open
+        smtp.send(b'.\r\n')
+        smtp.getreply()
+    if mail_code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(mail_code, mail_resp, sender)
+    if rcpt_code not in (250, 251):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused({recipient: (rcpt_code, rcpt_resp)})
+    if data_code != 354:
+        smtp.rset()
+        raise smtplib.SMTPDataError(data_code, data_resp)
+
+    smtp.send(data + b'.\r\n')
+    code, resp = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+
+def send_with_pool(pool, settings, alert, is_insecure):
+    """Borrows a connection from the pool, sends the alert and hands the connection back."""
+    import smtplib
+    smtp = pool.get()
     try:
-        if use_ssl:
-            with smtplib.SMTP_SSL(host, port, context=context) as s:
-                s.login(user, password)
-                s.send_message(msg)
-        else:
-            with smtplib.SMTP(host, port) as s:
-                s.starttls(context=context)
-                s.login(user, password)
-                s.send_message(msg)
-        return True
-    except Exception as e:
-        sys.stderr.write(f"Email Failed: {e}\n")
+        # A dropped session gets one fresh connection before the alert counts as failed
+        for attempt in range(2):
+            try:
+                smtp = check_smtp(settings, smtp)
+                send_email(smtp, settings, alert, is_insecure)
+                return True
+            except smtplib.SMTPServerDisconnected as e:
+                error = e
+                continue
+            except Exception as e:
+                error = e
+                break
+        sys.stderr.write(f"Email Failed: {error}\n")
         return False
+    finally:
+        pool.put(smtp)
+
+def open_api(api_url):
+    """Opens a keep-alive connection to the Cloudflare worker. Returns (connection, base path)."""
+    parts = urllib.parse.urlsplit(api_url)
+    target_port = parts.port or (80 if parts.scheme == 'http' else 443)
+
+    # Honour http(s)_proxy / no_proxy like urlopen's ProxyHandler did
+    proxy = urllib.request.getproxies().get(parts.scheme)
+    if proxy and urllib.request.proxy_bypass(parts.hostname):
+        proxy = None
+
+    if proxy:
+        proxy_parts = urllib.parse.urlsplit(proxy if '://' in proxy else f"http://{proxy}")
+        host, port = proxy_parts.hostname, proxy_parts.port
+    else:
+        host, port = parts.hostname, target_port
+
+    if parts.scheme == 'http':
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+    else:
+        conn = http.client.HTTPSConnection(host, port, timeout=30, context=get_ssl_context())
+
+    if proxy:
+        # CONNECT through the proxy so GET and DELETE still share one tunnelled connection
+        tunnel_headers = {}
+        if proxy_parts.username:
+            creds = f"{urllib.parse.unquote(proxy_parts.username)}:{urllib.parse.unquote(proxy_parts.password or '')}"
+            tunnel_headers["Proxy-Authorization"] = "Basic " + base64.b64encode(creds.encode()).decode('ascii')
+        conn.set_tunnel(parts.hostname, target_port, headers=tunnel_headers)
+    return conn, parts.path
+
+def api_request(conn, method, path, headers):
+    """Issues one request on the shared API connection. Returns (response, body)."""
+    for attempt in range(2):
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The worker closed the idle keep-alive socket; reconnect once
+            conn.close()
+            if attempt == 1:
+                raise
+    # http.client does not follow redirects, so anything but 2xx (or 304 for the
+    # conditional outbox GET) means the request did not do what we asked
+    if not (200 <= response.status < 300 or response.status == 304):
+        raise http.client.HTTPException(f"HTTP Error {response.status}: {response.reason}")
+    return response, body
+
+def load_outbox_etag():
+    """Returns the ETag of the last empty outbox seen, or None."""
+    try:
+        with open(ETAG_FILE, 'r') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def save_outbox_etag(etag):
+    """Remembers the ETag of an empty outbox; None forgets it."""
+    try:
+        if etag:
+            os.makedirs(os.path.dirname(ETAG_FILE), exist_ok=True)
+            with open(ETAG_FILE, 'w') as f:
+                f.write(etag)
+        elif os.path.exists(ETAG_FILE):
+            os.remove(ETAG_FILE)
+    except OSError:
+        pass
 
 def main():
     config = load_config()
@@ -157,6 +374,7 @@ def main():
     api_url = config.get('Cloudflare', 'api_url').rstrip('/')
     api_token = config.get('Cloudflare', 'api_token')
     squelched = config.getboolean('Settings', 'squelch', fallback=False)
+    tz_setting = config.get('Settings', 'timezone', fallback='local').lower()
 
     headers = {
         "Authorization": f"Bearer {api_token}",
@@ -164,18 +382,25 @@ def main():
         "User-Agent": "HealthcheckWatch-emailcheck.py/1.0"
     }
 
-    req = urllib.request.Request(f"{api_url}/outbox", headers=headers)
+    # GET and DELETE share one connection so the TLS handshake happens once per run
+    conn, base_path = open_api(api_url)
     
+    # Only an empty outbox is ever remembered, so a 304 can never hide pending alerts
+    get_headers = dict(headers)
+    etag = load_outbox_etag()
+    if etag:
+        get_headers["If-None-Match"] = etag
+
     alerts = []
     max_retries = 3
 
     for attempt in range(max_retries):
         try:
-            with urllib.request.urlopen(req, timeout=30) as response:
-                response_data = response.read().decode('utf-8')
-                alerts = json.loads(response_data)
-                break 
-        except (urllib.error.URLError, TimeoutError, ConnectionResetError) as e:
+            response, body = api_request(conn, "GET", f"{base_path}/outbox", get_headers)
+            alerts = [] if response.status == 304 else json.loads(body)
+            break 
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
             if attempt < max_retries - 1:
                 # ONLY print if we are NOT in cron (isatty is True)
                 if sys.stdout.isatty():
@@ -188,33 +413,60 @@ def main():
                 sys.exit(1)
 
     if not alerts:
+        if response.status != 304:
+            save_outbox_etag(response.getheader('ETag'))
+        conn.close()
         return
 
+    # Alerts must be downloaded in full on every run until the outbox is cleared
+    save_outbox_etag(None)
+
     if sys.stdout.isatty():
         mode = "SQUELCHED | Logging only" if squelched else "Sending Emails"
         print(f"Processing {len(alerts)} alerts | {mode}")
 
     all_processed = True
 
+    records = []
     for alert in alerts:
-        alert['header_time'], alert['body'] = format_alert_times(config, alert)
-        archive_locally(alert, db_name)
-        
-        if not squelched:
-            if not send_email(config, alert, is_insecure):
-                all_processed = False
-                sys.stderr.write(f"Warning: Email failed for '{alert.get('subject')}'.\n")
+        alert['header_time'], alert['body'] = format_alert_times(tz_setting, alert)
+        records.append(build_archive_record(alert, db_name))
+    archive_locally(records)
+
+    if not squelched:
+        import queue
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Connections are opened lazily, so a single alert never pays for a whole pool
+        pool_size = max(1, min(config.getint('SMTP', 'pool_size', fallback=3), len(alerts)))
+        settings = load_smtp_settings(config)
+        pool = queue.Queue()
+        for _ in range(pool_size):
+            pool.put(None)
+
+        try:
+            with ThreadPoolExecutor(max_workers=pool_size) as executor:
+                futures = [executor.submit(send_with_pool, pool, settings, alert, is_insecure) for alert in alerts]
+            for alert, future in zip(alerts, futures):
+                if not future.result():
+                    all_processed = False
+                    sys.stderr.write(f"Warning: Email failed for '{alert.get('subject')}'.\n")
+        finally:
+            while not pool.empty():
+                smtp = pool.get()
+                if smtp is not None:
+                    close_smtp(smtp)
 
     if all_processed:
-        del_req = urllib.request.Request(f"{api_url}/outbox", headers=headers, method='DELETE')
         try:
-            with urllib.request.urlopen(del_req, timeout=30) as response:
-                pass
+            api_request(conn, "DELETE", f"{base_path}/outbox", headers)
             if sys.stdout.isatty():
                 print(f"DONE | Cloudflare outbox cleared ({db_name})")
         except Exception as e:
             sys.stderr.write(f"Failed to clear outbox: {e}\n")
 
+    conn.close()
+
 
 if __name__ == "__main__":
     main()
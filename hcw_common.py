@@ -0,0 +1,85 @@
+"""Helpers shared by emailcheck.py and manage.py."""
+import os
+import re
+import json
+import configparser
+from functools import lru_cache
+
+# --- SETUP PATHS ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(BASE_DIR, "config.ini")
+WRANGLER_FILE = os.path.join(BASE_DIR, "wrangler.jsonc")
+LOG_FILE = os.path.join(BASE_DIR, "logs", "email_log")
+PARSE_CACHE_FILE = os.path.join(BASE_DIR, "logs", ".parse_cache.json")
+
+def cached_parse(path, parser_fn):
+    """Returns parser_fn(path), reusing the last result while the file is unchanged."""
+    st = os.stat(path)
+    key = [st.st_mtime_ns, st.st_size]
+    slot = f"{path}:{parser_fn.__name__}"
+    # JSON rather than pickle: loading this file must never be able to run code
+    try:
+        with open(PARSE_CACHE_FILE, 'r') as f:
+            cache = json.load(f)
+    except Exception:
+        cache = {}
+    if not isinstance(cache, dict):
+        cache = {}
+    hit = cache.get(slot)
+    if isinstance(hit, list) and len(hit) == 2 and hit[0] == key:
+        return hit[1]
+
+    value = parser_fn(path)
+    cache[slot] = [key, value]
+    try:
+        # Write-then-rename so overlapping cron runs never read a half-written cache
+        os.makedirs(os.path.dirname(PARSE_CACHE_FILE), exist_ok=True)
+        tmp = f"{PARSE_CACHE_FILE}.{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, PARSE_CACHE_FILE)
+    except OSError:
+        pass
+    return value
+
+# A string literal (unrolled so plain runs match in one step) or a comment. Strings are
+# tried first, so a "//" inside a URL is kept rather than read as a comment.
+JSONC_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|//[^\n]*|/\*.*?\*/', re.S)
+
+def strip_jsonc(text):
+    """Removes // and /* */ comments from JSONC text, leaving string contents untouched."""
+    return JSONC_TOKEN_RE.sub(lambda m: m.group(0) if m.group(0)[0] == '"' else '', text)
+
+def parse_db_name(path):
+    """Single Source of Truth: Extracts database_name from wrangler.jsonc."""
+    default = "healthcheckwatch-db"
+    try:
+        with open(path, 'r') as f:
+            data = json.loads(strip_jsonc(f.read()))
+            return data.get("d1_databases", [{}])[0].get("database_name", default)
+    except Exception:
+        return default
+
+@lru_cache(maxsize=1)
+def get_db_name():
+    """Returns the database_name from wrangler.jsonc, cached between runs."""
+    if not os.path.exists(WRANGLER_FILE):
+        return "healthcheckwatch-db"
+    return cached_parse(WRANGLER_FILE, parse_db_name)
+
+def parse_tz_setting(path):
+    """Reads the timezone setting from config.ini."""
+    # Fixed: Added inline_comment_prefixes so "UTC # comment" parses as "UTC"
+    config = configparser.ConfigParser(interpolation=None, inline_comment_prefixes=('#', ';'))
+    config.read(path)
+    try:
+        return config.get('Settings', 'timezone', fallback='local').lower()
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        return 'local'
+
+@lru_cache(maxsize=1)
+def get_tz_setting():
+    """Returns the timezone setting from config.ini, cached between runs."""
+    if not os.path.exists(CONFIG_FILE):
+        return 'local'
+    return cached_parse(CONFIG_FILE, parse_tz_setting)
@@ -1,49 +1,22 @@
 #!/usr/bin/env python3
 import os
-import re
 import sys
 import json
 import time
 import argparse
 import subprocess
-import configparser
-from datetime import datetime, timezone
-
-def get_db_name():
-    """Single Source of Truth: Extracts database_name from wrangler.jsonc."""
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrangler.jsonc")
-    default = "healthcheckwatch-db"
-    if not os.path.exists(path):
-        return default
-    try:
-        with open(path, 'r') as f:
-            content = f.read()
-            content = re.sub(r'//.*', '', content)
-            content = re.sub(r'/\*.*?\*/', '', content, flags=re.DOTALL)
-            data = json.loads(content)
-            return data.get("d1_databases", [{}])[0].get("database_name", default)
-    except Exception:
-        return default
+from datetime import datetime
+from hcw_common import LOG_FILE, WRANGLER_FILE, get_db_name, get_tz_setting, strip_jsonc
 
 # --- CONFIGURATION ---
-DB_NAME = get_db_name()
-LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "email_log")
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(BASE_DIR, "config.ini")
-
-def get_tz_setting():
-    """Reads the timezone setting from config.ini."""
-    if not os.path.exists(CONFIG_FILE):
-        return 'local'
-    # Fixed: Added inline_comment_prefixes so "UTC # comment" parses as "UTC"
-    config = configparser.ConfigParser(interpolation=None, inline_comment_prefixes=('#', ';'))
-    config.read(CONFIG_FILE)
-    try:
-        return config.get('Settings', 'timezone', fallback='local').lower()
-    except (configparser.NoSectionError, configparser.NoOptionError):
-        return 'local'
-
-TZ_SETTING = get_tz_setting()
+# DB_NAME and TZ_SETTING are resolved lazily (PEP 562); inside this file call the getters.
+def __getattr__(name):
+    """Resolves DB_NAME and TZ_SETTING on first use so commands that never need them skip the parse."""
+    if name == 'DB_NAME':
+        return get_db_name()
+    if name == 'TZ_SETTING':
+        return get_tz_setting()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def cmd_deploy(args):
     """Pushes the local index.js and wrangler.jsonc to Cloudflare."""
@@ -67,15 +40,17 @@ def cmd_deploy(args):
 
 def run_wrangler(sql):
     """Executes a D1 SQL command via Wrangler and returns the JSON results."""
-    cmd = ["npx", "wrangler", "d1", "execute", DB_NAME, "--remote", "--json", "--command", sql]
+    cmd = ["npx", "wrangler", "d1", "execute", get_db_name(), "--remote", "--json", "--command", sql]
     try:
-        # Run wrangler, hiding stderr unless it completely fails
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
+        # Run wrangler, hiding stderr unless it completely fails.
+        # stdout stays raw bytes: json.loads() decodes it without an intermediate str.
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            sys.stderr.write(f"Wrangler Error:\n{err.decode(errors='replace')}\n")
+            sys.exit(1)
+        data = json.loads(out)
         return data[0].get('results', [])
-    except subprocess.CalledProcessError as e:
-        sys.stderr.write(f"Wrangler Error:\n{e.stderr}\n")
-        sys.exit(1)
     except Exception as e:
         sys.stderr.write(f"Execution Error: {e}\n")
         sys.exit(1)
@@ -85,11 +60,12 @@ def format_time(epoch):
     if not epoch:
         return "N/A"
     
-    if TZ_SETTING == 'utc':
-        return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    # time.strftime on a struct_time skips building a datetime object for every row
+    if get_tz_setting() == 'utc':
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch))
     else:
         # Defaults to the server's local system timezone
-        return datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(epoch))
 
 def cmd_list(args):
     results = run_wrangler("SELECT id, last_ping, timeout_hours FROM monitors ORDER BY id ASC")
@@ -97,7 +73,7 @@ def cmd_list(args):
         print("No active monitors found.")
         return
 
-    tz_label = "(UTC)" if TZ_SETTING == 'utc' else "(LOCAL)"
+    tz_label = "(UTC)" if get_tz_setting() == 'utc' else "(LOCAL)"
 
     print(f"{'MONITOR ID':<30} | {'LAST PING ' + tz_label:<20} | {'DEATH DATE ' + tz_label}")
     print("-" * 75)
@@ -147,7 +123,7 @@ def cmd_pause(args):
 def get_cron_minutes_until():
     """Parses wrangler.jsonc to find the next cron execution time."""
     current_minute = datetime.now().minute
-    path = os.path.join(BASE_DIR, "wrangler.jsonc")
+    path = WRANGLER_FILE
     
     # Fallback default if things go wrong
     default_until = 60 - current_minute
@@ -157,10 +133,7 @@ def get_cron_minutes_until():
         
     try:
         with open(path, 'r') as f:
-            content = f.read()
-            content = re.sub(r'//.*', '', content)
-            content = re.sub(r'/\*.*?\*/', '', content, flags=re.DOTALL)
-            data = json.loads(content)
+            data = json.loads(strip_jsonc(f.read()))
             
         crons = data.get("triggers", {}).get("crons", [])
         if not crons:
@@ -208,23 +181,45 @@ def cmd_test_alert(args):
     print(f"The Cloudflare watchdog will drop the alert in the outbox in ~{minutes_until} minutes.")
     print("Run emailcheck.py after then.")
 
+def tail_blocks(path, n, sep, chunk_size=65536):
+    """Returns the last n non-empty blocks of a sep-delimited file, reading backwards from EOF."""
+    blocks = []
+    buf = b''
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        while len(blocks) < n:
+            if pos > 0:
+                step = min(chunk_size, pos)
+                pos -= step
+                f.seek(pos)
+                # Logs written in text mode on Windows use CRLF; fold them so sep (LF-only) matches.
+                # Re-normalising the joined buffer also catches a CRLF split across chunks.
+                buf = (f.read(step) + buf).replace(b'\r\n', b'\n')
+            elif sep not in buf:
+                break
+            # Split from the right only as often as blocks are still missing;
+            # parts[0] keeps everything older (possibly a partial block) for the next pass
+            parts = buf.rsplit(sep, n - len(blocks))
+            buf = parts[0]
+            blocks = [b for b in parts[1:] if b.strip()] + blocks
+    if pos == 0 and len(blocks) < n and buf.strip():
+        blocks.insert(0, buf)
+    return [b.decode('utf-8', errors='replace').strip() for b in blocks[-n:]]
+
 def cmd_log(args):
     if not os.path.exists(LOG_FILE):
         print("Log file not found. No alerts have been processed locally yet.")
         return
         
-    with open(LOG_FILE, 'r') as f:
-        content = f.read()
-        
     # Split by the divider line you defined in emailcheck.py
-    blocks = [b.strip() for b in content.split("----------------------------------------------------------------\n\n") if b.strip()]
+    blocks = tail_blocks(LOG_FILE, 10, b"----------------------------------------------------------------\n\n")
     
     if not blocks:
         print("Log file is empty.")
         return
 
-    print(f"--- Showing last {min(10, len(blocks))} entries ---")
-    for block in blocks[-10:]:
+    print(f"--- Showing last {len(blocks)} entries ---")
+    for block in blocks:
         print("----------------------------------------------------------------")
         print(block)
         print("----------------------------------------------------------------\n")
@@ -55,8 +55,17 @@ export default {
     // Your local polling script calls this to download pending alerts
     if (request.method === 'GET' && path === '/outbox') {
       const { results } = await env.DB.prepare('SELECT * FROM outbox').all();
-      return new Response(JSON.stringify(results), { 
-        headers: { 'Content-Type': 'application/json' } 
+      const payload = JSON.stringify(results);
+
+      // Hash the payload so an unchanged (usually empty) outbox can be answered with a bodiless 304
+      const digest = await crypto.subtle.digest('SHA-1', new TextEncoder().encode(payload));
+      const etag = `"${[...new Uint8Array(digest)].map(b => b.toString(16).padStart(2, '0')).join('')}"`;
+      if (request.headers.get('If-None-Match') === etag) {
+        return new Response(null, { status: 304, headers: { 'ETag': etag } });
+      }
+
+      return new Response(payload, { 
+        headers: { 'Content-Type': 'application/json', 'ETag': etag } 
       });
     }
 